@@ -1,8 +1,6 @@
 # app.py
 import streamlit as st
 from streamlit_javascript import st_javascript
-import engine_cn
-import engine_jp
 import time
 
 # =============================================================================
@@ -12,7 +10,9 @@ import time
 st.set_page_config(page_title="Quant Analysis Terminal", layout="wide")
 
 # CSSインジェクション：サイドバーの非表示、上部余白の最小化、ヘッダーの削除
-st.markdown("""
+# styleタグのみの st.html はイベントコンテナに送られ、Markdownの解析やレイアウト上の余白を伴わない
+# (再実行時に描画されない要素はStreamlitが削除するため、セッション単位で送信を省略することはできない)
+PAGE_CSS = """
     <style>
         [data-testid="stSidebar"] { display: none; }
         [data-testid="stHeader"] { display: none; }
@@ -22,18 +22,27 @@ st.markdown("""
             padding-right: 2rem !important;
         }
     </style>
-""", unsafe_allow_html=True)
+"""
+st.html(PAGE_CSS)
 
 # =============================================================================
 # 2. 言語検知ロジック (URLパラメータ > JavaScript検知)
 # =============================================================================
 
-# URLパラメータの確認 (例: ?lang=jp)
+# URLパラメータの確認 (例: ?lang=jp / ?lang=cn)
 # クエリパラメータによる強制ルーティングを最優先する
 url_lang = st.query_params.get("lang", "").lower()
 
 # JavaScript経由でブラウザの言語設定 (navigator.language) を取得
-browser_lang = st_javascript("navigator.language")
+# セッション中は変化しないため、取得済みの値を再利用してJSの往復を省略する
+# (初回フレームでは結果が未到着のため、有効な文字列が返った時点でのみ保存)
+# 言語が判定済み、またはURLで指定されている場合はJavaScript検知自体を省略する
+if (st.session_state.get("lang_mode") is None and url_lang not in ("jp", "cn")
+        and not st.session_state.get("browser_lang")):
+    js_lang = st_javascript("navigator.language")
+    if isinstance(js_lang, str) and js_lang:
+        st.session_state.browser_lang = js_lang
+browser_lang = st.session_state.get("browser_lang")
 
 # セッション状態 (st.session_state) の初期化
 if "lang_mode" not in st.session_state:
@@ -46,6 +55,8 @@ if "lang_mode" not in st.session_state:
 if st.session_state.lang_mode is None:
     if url_lang == "jp":
         st.session_state.lang_mode = "JP"
+    elif url_lang == "cn":
+        st.session_state.lang_mode = "CN"
     elif browser_lang: # JavaScriptの実行結果が返ってきた場合
         if "ja" in browser_lang.lower():
             st.session_state.lang_mode = "JP"
@@ -58,15 +69,19 @@ if st.session_state.lang_mode is None:
 # =============================================================================
 # 3. 右上部の言語切り替えボタン (日/中 トグル)
 # =============================================================================
+def toggle_lang():
+    """言語モードを反転させるコールバック（ボタン押下後の再実行より前に呼ばれる）"""
+    # 未初期化状態でのクリックを考慮し、現在のステータスを反転させる
+    current = st.session_state.lang_mode if st.session_state.lang_mode else "CN"
+    st.session_state.lang_mode = "JP" if current == "CN" else "CN"
+    # 選択結果をURLにも反映し、再読み込みや共有時に維持されるようにする
+    st.query_params["lang"] = st.session_state.lang_mode.lower()
+
 # タイトル行と同じ高さにボタンを配置するためのカラムレイアウト
+# コールバック方式のため、st.rerun() による二重実行は不要
 h_col1, h_col2 = st.columns([12, 1])
 with h_col2:
-    if st.button("日/中"):
-        # 未初期化状態でのクリックを考慮し、現在のステータスを反転させる
-        current = st.session_state.lang_mode if st.session_state.lang_mode else "CN"
-        st.session_state.lang_mode = "JP" if current == "CN" else "CN"
-        # 状態変更後に即時再レンダリングを実行
-        st.rerun()
+    st.button("日/中", on_click=toggle_lang)
 
 # =============================================================================
 # 4. エンジンの実行とルーティング
@@ -74,9 +89,17 @@ with h_col2:
 # 最終的なフォールバック：検知が完了していない場合はデフォルト(CN)を使用
 final_mode = st.session_state.lang_mode if st.session_state.lang_mode else "CN"
 
+# 判定済みの言語をURLパラメータに同期する（次回以降の訪問ではJS検知が不要になる）
+# 検知待ちの間に書き込むとデフォルト(CN)で固定されるため、確定後のみ同期する
+if st.session_state.lang_mode and url_lang != final_mode.lower():
+    st.query_params["lang"] = final_mode.lower()
+
+# 選択された市場のエンジンのみを import し、未使用側の依存ライブラリの読み込みを避ける
 if final_mode == "JP":
     # 日本市場向けエンジン (engine_jp.py) を実行
+    import engine_jp
     engine_jp.render_jp_ui()
 else:
     # 中国市場向けエンジン (engine_cn.py) を実行
+    import engine_cn
     engine_cn.render_cn_ui()
\ No newline at end of file
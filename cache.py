@@ -0,0 +1,93 @@
+# cache.py
+import os
+import glob
+import time
+import datetime
+import threading
+import pandas as pd
+
+# =============================================================================
+# ディスクキャッシュ (Parquet L2 Cache)
+# st.cache_data (プロセス内メモリ) の下層に置き、プロセス再起動後も取得済みデータを再利用する
+# =============================================================================
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DEFAULT_TTL = 86400 # 既定の有効期限：1日 (秒)
+CURRENT_YEAR_TTL = 3600 # 当年分など更新が続くデータの有効期限：1時間 (秒)
+# ※ 株価の年ブロックは調整後価格の基準を揃えるため same_day_ttl を使い、照会日の0時より前のファイルは常に期限切れとなる
+#    (DEFAULT_TTL を延ばしても年ブロックの再利用期間は延びない。延ばせば基準の異なるブロックが連結されるため変更しないこと)
+
+def same_day_ttl(asof, ttl=None):
+    """
+    照会日 asof(datetime.date) の0時以降に書き込まれたファイルのみを有効とする有効期限(秒)を返す
+    ttl を指定した場合は、その期限とのうち短い方を返す
+    """
+    since_midnight = time.time() - datetime.datetime.combine(asof, datetime.time()).timestamp()
+    return since_midnight if ttl is None else min(ttl, since_midnight)
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, f"{key}.parquet")
+
+def load(key, ttl=None):
+    """
+    キャッシュファイルを読み込む
+    引数: key(キャッシュキー), ttl(有効期限・秒。None の場合は期限を問わない)
+    戻り値: DataFrame、ファイルなし・期限切れ・破損時は None
+    """
+    path = _cache_path(key)
+    try:
+        # ファイルの更新時刻で有効期限を判定する
+        if ttl is None or time.time() - os.path.getmtime(path) < ttl:
+            return pd.read_parquet(path)
+    except Exception as e:
+        pass # ファイルなし・破損時は None を返し、呼び出し側で再取得させる
+    return None
+
+def save(key, df):
+    """DataFrame をキャッシュファイルに書き込む（失敗しても例外は送出しない）"""
+    path = _cache_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # 一時ファイルに書き出してから置き換え、書き込み途中のファイルが読まれないようにする
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        pass # 書き込みに失敗しても取得結果はそのまま利用できる
+
+def load_or_fetch(key, fetch, ttl=DEFAULT_TTL):
+    """
+    有効期限内のキャッシュファイルがあれば読み込み、なければ fetch() で取得して保存する
+    引数: key(キャッシュキー、ファイル名に使用), fetch(DataFrame または None を返す関数), ttl(有効期限・秒)
+    戻り値: DataFrame または None
+    """
+    df = load(key, ttl)
+    if df is not None:
+        return df
+
+    df = fetch()
+    if df is not None:
+        save(key, df)
+    return df
+
+def load_same_day(keys):
+    """
+    期限を問わず複数のキャッシュファイルを読み込む（取得できない場合の代替用）
+    調整後価格の基準が食い違わないよう、すべてのファイルが同じ日に書き込まれたものである場合のみ返す
+    戻り値: DataFrame のリスト、ファイルがない・書き込み日が揃わない場合は None
+    """
+    try:
+        days = {datetime.date.fromtimestamp(os.path.getmtime(_cache_path(key))) for key in keys}
+    except OSError:
+        return None
+    if len(days) != 1: return None
+    frames = [load(key) for key in keys]
+    return None if any(f is None for f in frames) else frames
+
+def invalidate(prefix):
+    """キーが prefix で始まるキャッシュファイルをすべて削除する"""
+    for path in glob.glob(os.path.join(CACHE_DIR, f"{glob.escape(prefix)}*.parquet")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
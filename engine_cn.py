@@ -1,80 +1,279 @@
 # engine_cn.py
 import streamlit as st
-import akshare as ak
 import pandas as pd
+import numpy as np
 import datetime
-import calendar
 import os
+from functools import lru_cache
+from utils import (MONTH_LABELS, MONTH_LABELS_2D, get_nearest_indices, fetch_year_blocks, match_monthly_trades,
+                   year_date_table, next_month_mids, load_ranking, df_to_csv_bytes)
+import cache
+import net
 
 # =============================================================================
 # 核心ツール関数ライブラリ (Core Utility Functions)
 # =============================================================================
 
-@st.cache_data(ttl=3600) # キャッシュを有効化し、リクエストの重複を避ける
+def _download_year_data(symbol, year):
+    """akshare から1年分(1月1日〜12月31日)の日次データを取得する"""
+    # akshare は読み込みが重いため、実際に取得が必要になった時点で import する
+    import akshare as ak
+    net.install() # HTTP接続を共有セッション経由にし、年ごと・銘柄ごとの再接続を避ける
+    # adjust="qfq" は前復権（株式分割等の調整済み価格）を意味する
+    df = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=f"{year}0101", end_date=f"{year}1231", adjust="qfq")
+    if df.empty: return None
+    # 日付は "YYYY-MM-DD" 固定のため書式を明示し、書式の推定を省く（date 型で返る場合もそのまま変換される）
+    df['日期'] = pd.to_datetime(df['日期'], format='%Y-%m-%d', cache=True)
+    return df[['日期', '收盘']]
+
+# メモリ上のキャッシュ(L1)は件数を制限する。再起動後の再利用はディスクキャッシュ(L2, cache.py)が担う
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False) # キャッシュを有効化し、リクエストの重複を避ける
+def _fetch_year_data(symbol, year, asof):
+    """
+    1年分の日次データを取得する（メモリキャッシュ → ディスクキャッシュ → ネットワークの順に参照）
+    asof: 照会日(datetime.date)。この日に取得したデータのみを使う
+    通信エラー時は例外をそのまま送出し、失敗結果がキャッシュされないようにする
+    """
+    # 前復権の価格は除権のたびに過去の日も遡って調整されるため、照会日の0時より前に書き込まれたファイルは期限切れとする
+    # (同じ照会で連結する年のブロックがすべて同じ日に取得したものとなり、年をまたいでも調整の基準が揃う)
+    # 当年はさらに取引日が追加されていくため、メモリキャッシュと同じ1時間でも取り直す
+    ttl = cache.same_day_ttl(asof, cache.CURRENT_YEAR_TTL if year >= asof.year else None)
+    return cache.load_or_fetch(f"cn_{symbol}_{year}_qfq", lambda: _download_year_data(symbol, year), ttl)
+
+def refresh_stock_data(symbol):
+    """指定銘柄のディスクキャッシュを削除し、メモリ上のキャッシュもクリアする（再取得用）"""
+    cache.invalidate(f"cn_{symbol}_")
+    _fetch_year_data.clear()
+    _build_price_table.clear()
+
 def get_stock_data(symbol, start_date, end_date):
     """
     日次データを取得する関数
-    引数: symbol(銘柄コード), start_date(開始日), end_date(終了日)
+    引数: symbol(銘柄コード), start_date(開始日), end_date(終了日) ※"YYYYMMDD"形式
     戻り値: 日付と終値を含むDataFrame
     """
+    # 暦年単位のブロックで取得・キャッシュし、期間の異なる照会（基礎照会の1年分と
+    # 回測の翌年3月まで等）でも同じ年のデータを共有する。未来の年は取得しない
+    # 照会日は一度だけ取得してキーに含め、連結する年のブロックを同じ日に取得したものに揃える
+    asof = datetime.date.today()
+    last_year = min(int(end_date[:4]), asof.year)
+    years = list(range(int(start_date[:4]), last_year + 1))
+    
+    # 複数年にまたがる場合は各年を並列に取得する
+    df = fetch_year_blocks(lambda y: _fetch_year_data(symbol, y, asof), years)
+    if df is None: return None
+    
+    df = df[(df['日期'] >= pd.Timestamp(start_date)) & (df['日期'] <= pd.Timestamp(end_date))].reset_index(drop=True)
+    return df if not df.empty else None
+
+# --- 日付ルールの計算ロジック (Date Rule Calculations) ---
+
+# 基礎照会・回測の曜日ルール（期货交割日：第3金曜日、期权交割日：第4水曜日）
+_DATE_RULES = (('futures', 'Fri', 3), ('option', 'Wed', 4))
+
+def get_target_dates(year, mode, today):
+    """
+    基礎照会の対象日を1年分まとめて生成する
+    mode: "A"(月中15日 & 月末) / "B"(期货第3金曜 & 期权第4水曜), today: 基準日(datetime.date)
+    戻り値: 'type', 'date' 列を持つDataFrame（日付順、基準日以前のみ）
+    """
+    table = year_date_table(year, _DATE_RULES)
+    # 基準日の月より後の月は対象日がすべて未来になるため、月の範囲から除外する
+    n_months = min(max(int((np.datetime64(today, 'M') - np.datetime64(f"{year}-01")).astype(int)) + 1, 0), 12)
+    if mode == "A":
+        parts = [("月中", table['mid']), ("月底", table['end'])]
+    else:
+        parts = [("期货交割日", table['futures']), ("期权交割日", table['option'])]
+    targets = pd.DataFrame({'type': np.repeat([name for name, _ in parts], n_months),
+                            'date': np.concatenate([dates[:n_months] for _, dates in parts])})
+    targets = targets[targets['date'] <= np.datetime64(today)]
+    return targets.sort_values('date', kind='stable').reset_index(drop=True)
+
+# --- 照会結果の集計ロジック (Result Builders) ---
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _build_price_table(symbol, year, mode, today):
+    """
+    基礎照会の結果表を生成する（キャッシュ対象）
+    データ取得に失敗した場合は例外を送出し、失敗結果がキャッシュされないようにする
+    """
+    df = get_stock_data(symbol, f"{year}0101", f"{year}1231")
+    if df is None:
+        raise LookupError(f"no trading data for {symbol} ({year})")
+
+    targets = get_target_dates(year, mode, today)
+    if targets.empty:
+        return pd.DataFrame()
+
+    # 全ターゲット日の最寄り取引日を一度の二分探索で求める
+    dates_arr = df['日期'].to_numpy()
+    close_arr = df['收盘'].to_numpy()
+    nearest_idx = get_nearest_indices(dates_arr, targets['date'].to_numpy())
+
+    # 結果表は列単位で一括生成し、行ごとの dict 生成と型推論を省く
+    target_dates = pd.DatetimeIndex(targets['date'])
+    act_dates = pd.DatetimeIndex(dates_arr[nearest_idx])
+    diffs = (act_dates - target_dates).days.to_numpy()
+    days = np.abs(diffs).astype(str)
+    notes = np.where(diffs > 0, np.char.add(np.char.add("延后", days), "天"),
+                     np.char.add(np.char.add("提前", days), "天"))
+    return pd.DataFrame({
+        "月份": MONTH_LABELS_2D[target_dates.month - 1], "类型": targets['type'].to_numpy(),
+        "目标日期": target_dates.strftime("%Y-%m-%d"), "实际交易日": act_dates.strftime("%Y-%m-%d"),
+        "收盘价": np.char.mod('%.2f', close_arr[nearest_idx]), "说明": np.where(diffs == 0, "当日", notes)
+    })
+
+def get_price_table(symbol, year, mode):
+    """
+    基礎照会の結果表を取得する
+    引数: symbol(銘柄コード), year(年份), mode("A" / "B")
+    戻り値: 結果のDataFrame（対象日がなければ空）、データ取得失敗時は None
+    """
+    # 銘柄・年・モードが同じであれば、再実行時は集計処理ごとキャッシュから返す
+    # 基準日は呼び出し時に一度だけ取得してキーに含め、日付が変わればキャッシュも切り替わるようにする
     try:
-        # adjust="qfq" は前復権（株式分割等の調整済み価格）を意味する
-        df = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
-        if df.empty: return None
-        df['日期'] = pd.to_datetime(df['日期'])
-        return df[['日期', '收盘']]
+        return _build_price_table(symbol, year, mode, datetime.date.today())
     except Exception as e:
         return None
 
-def get_nearest_price_info(target_date, df):
-    """
-    ターゲット日に最も近い取引日の情報を検索する
-    戻り値: (実際の取引日, 終値, 差分日数の説明)
-    """
-    if df is None or df.empty:
-        return None, None, ""
-        
-    # 時間差の絶対値が最小のインデックスを検索
-    nearest_idx = (df['日期'] - target_date).abs().idxmin()
-    actual_date = df.loc[nearest_idx, '日期']
-    price = df.loc[nearest_idx, '收盘']
-    
-    diff_days = (actual_date - target_date).days
-    
-    # 差分日数に基づいたラベル付け
-    note = "当日"
-    if diff_days > 0: note = f"延后{diff_days}天"
-    elif diff_days < 0: note = f"提前{abs(diff_days)}天"
-    
-    return actual_date, price, note
+# --- 策略回測ロジック (Backtest Logic) ---
 
-# --- 日付ルールの計算ロジック (Date Rule Calculations) ---
+# 回測の売買ルール（先頭がデフォルト。ランキングのスキャンでも使用）
+BUY_RULES = ["本月期货交割日(第3周五)", "本月期权交割日(第4周三)", "本月最后交易日"]
+SELL_RULES = ["下月第1个交易日", "下月15日(或最近交易日)"]
 
-def get_futures_delivery(year, month):
-    """先物交割日：第3金曜日"""
-    c = calendar.monthcalendar(year, month)
-    fridays = [week[4] for week in c if week[4] != 0]
-    return datetime.datetime(year, month, fridays[2]) if len(fridays) >= 3 else None
+@lru_cache(maxsize=128)
+def _compute_targets(year, buy_rule, sell_rule):
+    """
+    12か月分の買入・売出のターゲット日を求める（銘柄に依存しないため、年とルールの組ごとにメモ化する）
+    戻り値: (買入ターゲット日, 売出ターゲット日) の datetime64 配列。位置で決まるルールは None
+    """
+    buys = sells = None
+    if "最后交易日" not in buy_rule:
+        buys = year_date_table(year, _DATE_RULES)['futures' if "期货" in buy_rule else 'option']
+    if "第1个" not in sell_rule:
+        sells = next_month_mids(year)
+    return buys, sells
 
-def get_option_delivery(year, month):
-    """期权交割日：第4水曜日"""
-    c = calendar.monthcalendar(year, month)
-    wednesdays = [week[2] for week in c if week[2] != 0]
-    return datetime.datetime(year, month, wednesdays[3]) if len(wednesdays) >= 4 else None
+def run_backtest(df, year, buy_rule, sell_rule):
+    """
+    月次の波段取引を検証する（買入は対象月内、売出は翌月内に厳格限定）
+    引数: df(翌年3月までの日次データ), year(回測年份), buy_rule/sell_rule(BUY_RULES / SELL_RULES の値)
+    戻り値: 月ごとの取引記録のDataFrame（取引が成立しなければ空）
+    """
+    # 列を一度だけ numpy 配列として取り出し、売買日の確定は共通の処理で12か月分を一括で行う
+    buy_targets, sell_targets = _compute_targets(year, buy_rule, sell_rule)
+    valid, b_dates, b_prices, s_dates, s_prices = match_monthly_trades(
+        df['日期'].to_numpy(), df['收盘'].to_numpy(), year, buy_targets, sell_targets)
+    # 月ごとの dict を作らず、成立した月の配列から列単位で一括生成する
+    return pd.DataFrame({
+        "月份": MONTH_LABELS[valid],
+        "买入日期": b_dates, "买入价": b_prices,
+        "卖出日期": s_dates, "卖出价": s_prices,
+        "收益": s_prices - b_prices
+    })
 
-def get_month_end(year, month):
-    """月末の最終日"""
-    _, last_day = calendar.monthrange(year, month)
-    return datetime.datetime(year, month, last_day)
+# --- ランキングファイルの読み込み (Ranking Files) ---
 
-def get_mid_month(year, month):
-    """月中の15日"""
-    return datetime.datetime(year, month, 15)
+def find_ranking_file(base):
+    """
+    スキャンファイルを検索する（Parquet を優先し、移行前の CSV にもフォールバックする）
+    引数: base(拡張子なしのファイル名、例 "SSE50_Scan_2024")
+    戻り値: 見つかったファイルのパス、なければ None
+    """
+    for path in (f"{base}.parquet", f"{base}.csv"):
+        if os.path.exists(path):
+            return path
+    return None
 
 # =============================================================================
 # メインUIレンダリングロジック (Main UI Rendering Logic)
 # =============================================================================
 
+# ----------------------------------------------------------------
+# 機能1：基礎照会 (Original Functionality)
+# ----------------------------------------------------------------
+@st.fragment
+def render_price_query():
+    """
+    基礎照会タブ。フラグメントとして描画し、操作時はこのタブのみ再実行する
+    """
+    col1_input, col1_result = st.columns([1, 3], gap="large")
+
+    with col1_input:
+        with st.container(border=True):
+            st.caption("查询设置")
+            t1_code = st.text_input("股票代码", value="600519", key="t1_code")
+            cur_year = datetime.datetime.now().year
+            t1_year = st.number_input("年份", min_value=2000, max_value=cur_year, value=cur_year, key="t1_year")
+
+            t1_mode_sel = st.radio(
+                "日期模式",
+                ("A: 月中(15日) & 月底", "B: 期货(第3周五) & 期权(第4周三)"),
+                key="t1_mode"
+            )
+            t1_run = st.button("查询股价", type="primary", use_container_width=True, key="t1_btn")
+            st.button("刷新数据", use_container_width=True, key="t1_refresh", on_click=refresh_stock_data, args=(t1_code,))
+
+    with col1_result:
+        if t1_run and t1_code:
+            with st.spinner('正在查询...'):
+                mode = "A" if "A:" in t1_mode_sel else "B"
+                res_df = get_price_table(t1_code, t1_year, mode)
+                if res_df is not None:
+                    if not res_df.empty:
+                        st.dataframe(res_df, use_container_width=True)
+                        # CSV はボタン押下時にのみ生成し、押されない再実行では変換を行わない
+                        st.download_button("📥 导出CSV", lambda: df_to_csv_bytes(res_df), f"{t1_code}_{t1_year}_基础查询.csv", "text/csv")
+                    else:
+                        st.info("没有符合日期的历史数据。")
+                else:
+                    st.error("数据获取失败，请检查代码。")
+
+# ----------------------------------------------------------------
+# 機能2：策略バックテスト (Strict Monthly Validation)
+# ----------------------------------------------------------------
+@st.fragment
+def render_backtest():
+    """
+    策略回测タブ。フラグメントとして描画し、操作時はこのタブのみ再実行する
+    """
+    col2_input, col2_result = st.columns([1, 3], gap="large")
+
+    with col2_input:
+        with st.container(border=True):
+            st.caption("回测参数")
+            t2_code = st.text_input("股票代码", value="600519", key="t2_code")
+            cur_year = datetime.datetime.now().year
+            t2_year = st.number_input("回测年份", min_value=2010, max_value=cur_year, value=cur_year-1, key="t2_year")
+            st.divider()
+            buy_rule = st.selectbox("🔵 买入点", BUY_RULES, key="buy_rule")
+            sell_rule = st.selectbox("🔴 卖出点", SELL_RULES, key="sell_rule")
+            t2_run = st.button("开始回测", type="primary", use_container_width=True, key="t2_btn")
+            st.button("刷新数据", use_container_width=True, key="t2_refresh", on_click=refresh_stock_data, args=(t2_code,))
+
+    with col2_result:
+        if t2_run and t2_code:
+            with st.spinner('正在计算跨年收益...'):
+                # 決済期間をまたぐため、翌年3月までのデータを取得
+                df = get_stock_data(t2_code, f"{t2_year}0101", f"{t2_year+1}0301")
+                if df is not None:
+                    t_df = run_backtest(df, t2_year, buy_rule, sell_rule)
+                    if not t_df.empty:
+                        first_buy, last_sell, total_profit = t_df.iloc[0]['买入价'], t_df.iloc[-1]['卖出价'], t_df['收益'].sum()
+                        st.success(f"回测完成：{t2_code} ({t2_year})")
+                        k1, k2, k3 = st.columns(3)
+                        k1.metric("初始投入", f"{first_buy:.2f}")
+                        k2.metric("策略收益率 (波段)", f"{(total_profit/first_buy)*100:.2f}%", delta=f"{total_profit:.2f}元")
+                        k3.metric("长持收益率 (死拿)", f"{(last_sell/first_buy-1)*100:.2f}%", delta=f"{last_sell-first_buy:.2f}元")
+                        # 価格列・日付列は値の型のまま渡し、表示形式はフロントエンド側で指定する（値の順での並べ替えも維持される）
+                        st.dataframe(t_df, use_container_width=True, hide_index=True, column_config={
+                            **{c: st.column_config.NumberColumn(format="%.2f") for c in ("买入价", "卖出价", "收益")},
+                            **{c: st.column_config.DateColumn(format="YYYY-MM-DD") for c in ("买入日期", "卖出日期")}
+                        })
+                    else:
+                        st.warning(f"该年份 ({t2_year}) 数据不足。")
+
 def render_cn_ui():
     """
     中国市場（A株）向けのメインUI。UI上の表記はすべて中国語を維持する。
@@ -84,135 +283,11 @@ def render_cn_ui():
     # タブによる機能モジュールの分離
     tab1, tab2, tab3 = st.tabs(["🔍 基础查询 (特定日期股价)", "📊 策略回测 (波段 vs 长持)", "🏆 排行榜"])
 
-    # ----------------------------------------------------------------
-    # 機能1：基礎照会 (Original Functionality)
-    # ----------------------------------------------------------------
     with tab1:
-        col1_input, col1_result = st.columns([1, 3], gap="large")
-        
-        with col1_input:
-            with st.container(border=True):
-                st.caption("查询设置")
-                t1_code = st.text_input("股票代码", value="600519", key="t1_code")
-                cur_year = datetime.datetime.now().year
-                t1_year = st.number_input("年份", min_value=2000, max_value=cur_year, value=cur_year, key="t1_year")
-                
-                t1_mode_sel = st.radio(
-                    "日期模式",
-                    ("A: 月中(15日) & 月底", "B: 期货(第3周五) & 期权(第4周三)"),
-                    key="t1_mode"
-                )
-                t1_run = st.button("查询股价", type="primary", use_container_width=True, key="t1_btn")
-
-        with col1_result:
-            if t1_run and t1_code:
-                with st.spinner('正在查询...'):
-                    df = get_stock_data(t1_code, f"{t1_year}0101", f"{t1_year}1231")
-                    if df is not None:
-                        target_list = []
-                        mode = "A" if "A:" in t1_mode_sel else "B"
-                        
-                        for m in range(1, 13):
-                            today = datetime.datetime.now()
-                            dates_to_check = []
-                            
-                            if mode == "A":
-                                dates_to_check = [("月中", get_mid_month(t1_year, m)), ("月底", get_month_end(t1_year, m))]
-                            else:
-                                f_day, o_day = get_futures_delivery(t1_year, m), get_option_delivery(t1_year, m)
-                                if f_day: dates_to_check.append(("期货交割日", f_day))
-                                if o_day: dates_to_check.append(("期权交割日", o_day))
-                            
-                            for type_name, dt in dates_to_check:
-                                if dt <= today:
-                                    act_date, price, note = get_nearest_price_info(dt, df)
-                                    if price is not None:
-                                        target_list.append({
-                                            "月份": f"{dt.strftime('%m')}月", "类型": type_name, "目标日期": dt.strftime("%Y-%m-%d"),
-                                            "实际交易日": act_date.strftime("%Y-%m-%d"), "收盘价": f"{price:.2f}", "说明": note
-                                        })
-                        
-                        if target_list:
-                            res_df = pd.DataFrame(target_list)
-                            st.dataframe(res_df, use_container_width=True)
-                            csv = res_df.to_csv(index=False).encode('utf-8-sig')
-                            st.download_button("📥 导出CSV", csv, f"{t1_code}_{t1_year}_基础查询.csv", "text/csv")
-                        else:
-                            st.info("没有符合日期的历史数据。")
-                    else:
-                        st.error("数据获取失败，请检查代码。")
+        render_price_query()
 
-    # ----------------------------------------------------------------
-    # 機能2：策略バックテスト (Strict Monthly Validation)
-    # ----------------------------------------------------------------
     with tab2:
-        col2_input, col2_result = st.columns([1, 3], gap="large")
-        
-        with col2_input:
-            with st.container(border=True):
-                st.caption("回测参数")
-                t2_code = st.text_input("股票代码", value="600519", key="t2_code")
-                t2_year = st.number_input("回测年份", min_value=2010, max_value=cur_year, value=cur_year-1, key="t2_year")
-                st.divider()
-                buy_rule = st.selectbox("🔵 买入点", ["本月期货交割日(第3周五)", "本月期权交割日(第4周三)", "本月最后交易日"], key="buy_rule")
-                sell_rule = st.selectbox("🔴 卖出点", ["下月第1个交易日", "下月15日(或最近交易日)"], key="sell_rule")
-                t2_run = st.button("开始回测", type="primary", use_container_width=True, key="t2_btn")
-
-        with col2_result:
-            if t2_run and t2_code:
-                with st.spinner('正在计算跨年收益...'):
-                    # 決済期間をまたぐため、翌年3月までのデータを取得
-                    df = get_stock_data(t2_code, f"{t2_year}0101", f"{t2_year+1}0301")
-                    if df is not None:
-                        trades = []
-                        df['Year'] = df['日期'].dt.year
-                        df['Month'] = df['日期'].dt.month
-                        
-                        for m in range(1, 13):
-                            b_date, b_price, s_date, s_price = None, None, None, None
-                            # 1. 【買入】日の確定 (対象月内に厳格限定)
-                            curr_month_df = df[(df['Year'] == t2_year) & (df['Month'] == m)]
-                            if not curr_month_df.empty:
-                                if "最后交易日" in buy_rule:
-                                    row = curr_month_df.iloc[-1]
-                                    b_date, b_price = row['日期'], row['收盘']
-                                else:
-                                    target_buy = get_futures_delivery(t2_year, m) if "期货" in buy_rule else get_option_delivery(t2_year, m)
-                                    if target_buy:
-                                        nearest_idx = (curr_month_df['日期'] - target_buy).abs().idxmin()
-                                        b_date, b_price = curr_month_df.loc[nearest_idx, '日期'], curr_month_df.loc[nearest_idx, '收盘']
-                            
-                            # 2. 【売出】日の確定 (翌月内に厳格限定)
-                            if b_date: 
-                                n_y, n_m = (t2_year, m + 1) if m < 12 else (t2_year + 1, 1)
-                                next_month_df = df[(df['Year'] == n_y) & (df['Month'] == n_m)]
-                                if not next_month_df.empty:
-                                    if "第1个" in sell_rule:
-                                        row = next_month_df.iloc[0]
-                                        s_date, s_price = row['日期'], row['收盘']
-                                    else:
-                                        target_sell = datetime.datetime(n_y, n_m, 15)
-                                        nearest_idx = (next_month_df['日期'] - target_sell).abs().idxmin()
-                                        s_date, s_price = next_month_df.loc[nearest_idx, '日期'], next_month_df.loc[nearest_idx, '收盘']
-                                
-                                # 3. トレードの記録
-                                if s_date and s_price and s_date > b_date:
-                                    trades.append({
-                                        "月份": f"{m}月", "买入日期": b_date.strftime("%Y-%m-%d"), "买入价": b_price,
-                                        "卖出日期": s_date.strftime("%Y-%m-%d"), "卖出价": s_price, "收益": s_price - b_price
-                                    })
-                        
-                        if trades:
-                            t_df = pd.DataFrame(trades)
-                            first_buy, last_sell, total_profit = t_df.iloc[0]['买入价'], t_df.iloc[-1]['卖出价'], t_df['收益'].sum()
-                            st.success(f"回测完成：{t2_code} ({t2_year})")
-                            k1, k2, k3 = st.columns(3)
-                            k1.metric("初始投入", f"{first_buy:.2f}")
-                            k2.metric("策略收益率 (波段)", f"{(total_profit/first_buy)*100:.2f}%", delta=f"{total_profit:.2f}元")
-                            k3.metric("长持收益率 (死拿)", f"{(last_sell/first_buy-1)*100:.2f}%", delta=f"{last_sell-first_buy:.2f}元")
-                            st.dataframe(t_df, use_container_width=True, hide_index=True)
-                        else:
-                            st.warning(f"该年份 ({t2_year}) 数据不足。")
+        render_backtest()
 
     # ----------------------------------------------------------------
     # 功能3：ランキング (CSV Reader)
@@ -223,14 +298,31 @@ def render_cn_ui():
         with col3_left:
             dataset = st.radio("📊 选择数据集", ["上证50 (SSE50)", "沪深300 (CSI300)"])
             scan_year = st.number_input("扫描年份", 2020, 2026, 2024, step=1)
-            target_file = f"{'SSE50' if '50' in dataset else 'CSI300'}_Scan_{scan_year}.csv"
+            dataset_key = 'SSE50' if '50' in dataset else 'CSI300'
+            scan_base = f"{dataset_key}_Scan_{scan_year}"
+            rescan = st.button("重新扫描", use_container_width=True, key="t3_rescan")
         with col3_right:
-            if os.path.exists(target_file):
+            if rescan:
+                # 構成銘柄を並列に回測し、スキャンファイルを生成し直す
+                # scanner は engine_cn を参照するため、実行時に import する
+                import scanner
+                with st.spinner('正在扫描成分股...'):
+                    # 失敗が多すぎる場合は build_ranking が例外を送出し、既存のスキャンファイルは上書きしない
+                    try:
+                        ranking, failed = scanner.build_ranking(dataset_key, scan_year)
+                        scanner.save_ranking(ranking, f"{scan_base}.parquet")
+                        if failed:
+                            st.warning(f"⚠️ {len(failed)} 只股票数据获取失败，未计入排行榜：{', '.join(failed)}")
+                    except Exception as e:
+                        st.error(f"扫描失败（未覆盖现有文件）: {e}")
+            target_file = find_ranking_file(scan_base)
+            if target_file:
                 try:
-                    df_rank = pd.read_csv(target_file)
+                    # 銘柄コードの先頭の0が落ちないよう、CSV の場合は文字列として読む
+                    df_rank = load_ranking(target_file, dtype={'代码': str})
                     st.success(f"✅ 成功读取文件，共包含 {len(df_rank)} 只股票数据。")
                     st.dataframe(df_rank.head(10), use_container_width=True)
                 except Exception as e:
                     st.error(f"文件读取出错: {e}")
             else:
-                st.warning(f"⚠️ 未找到文件 `{target_file}`。")
\ No newline at end of file
+                st.warning(f"⚠️ 未找到文件 `{scan_base}.parquet`。")
\ No newline at end of file
@@ -2,77 +2,102 @@
 import streamlit as st
 import yfinance as yf
 import pandas as pd
+import numpy as np
 import datetime
-import calendar
 import os # ファイル存在確認用
+from utils import (MONTH_LABELS, MONTH_LABELS_2D, get_nearest_indices, fetch_year_blocks, match_monthly_trades,
+                   year_date_table, next_month_mids, load_ranking, df_to_csv_bytes)
+import cache
 
 # ==========================================
 #              核心ツール関数ライブラリ
 # ==========================================
 
-@st.cache_data(ttl=3600) # キャッシュを追加し、リクエストの重複を避ける
-def get_stock_data(symbol, start_date, end_date):
-    """日次データを取得（yfinance版）"""
-    try:
-        # yfinanceを使用してデータを取得
-        df = yf.download(symbol, start=start_date, end=end_date, progress=False)
-        if df.empty: return None
+def _normalize_frame(df):
+    """yfinance の取得結果を '日付', '終値' の2列に整形する（データがなければ None）"""
+    if df.empty: return None
+    
+    # MultiIndex対策：カラムを平坦化
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = df.columns.get_level_values(0)
         
-        # MultiIndex対策：カラムを平坦化
-        if isinstance(df.columns, pd.MultiIndex):
-            df.columns = df.columns.get_level_values(0)
-            
-        df = df.reset_index()
-        # カラム名を統一（日付, 終値）
-        df.rename(columns={'Date': '日付', 'Close': '終値'}, inplace=True)
-        df['日付'] = pd.to_datetime(df['日付'])
-        return df[['日付', '終値']]
-    except Exception as e:
-        return None
+    # 終値以外の列（始値・高値・安値・出来高）は使わないため、最初に切り捨てる
+    df = df[['Close']].reset_index()
+    # カラム名を統一（日付, 終値）
+    df.rename(columns={'Date': '日付', 'Close': '終値'}, inplace=True)
+    # 日次データのため日付は日単位に丸める（終値は表示・損益の精度を保つため float64 のまま保持する）
+    # (pandas は日単位の datetime64 を持てないため、日単位に丸めた上で秒単位で保持される)
+    df['日付'] = pd.to_datetime(df['日付']).to_numpy().astype('datetime64[D]')
+    return df[['日付', '終値']]
+
+def _download_range(symbol, start_date, end_date):
+    """yfinance から期間 [start_date, end_date) の日次データを取得する"""
+    # 取得内容を明示する：調整後終値(auto_adjust)、配当・分割の列なし、時間外取引なし、丸めなし
+    # 単一銘柄のためスレッドも使わない
+    df = yf.download(symbol, start=start_date, end=end_date, progress=False, auto_adjust=True,
+                     actions=False, prepost=False, rounding=False, threads=False)
+    return _normalize_frame(df)
 
-def get_nearest_price_info(target_date, df):
+def _cache_key(symbol, year):
+    """年ブロックのディスクキャッシュのキー"""
+    return f"jp_{symbol}_{year}"
+
+# メモリ上のキャッシュ(L1)は件数を制限する。再起動後の再利用はディスクキャッシュ(L2, cache.py)が担う
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False) # キャッシュを追加し、リクエストの重複を避ける
+def _fetch_year_data(symbol, year, asof):
     """
-    最近の取引日情報を検索
-    戻り値: (実際の取引日, 終値, 差異日数の説明)
+    1年分の日次データを取得する（メモリキャッシュ → ディスクキャッシュ → ネットワークの順に参照）
+    asof: 照会日(datetime.date)。この日に取得したデータのみを使う
+    通信エラー時は例外をそのまま送出し、失敗結果がキャッシュされないようにする
     """
-    if df is None or df.empty:
-        return None, None, ""
-        
-    # 時間差の絶対値が最小のインデックスを特定
-    nearest_idx = (df['日付'] - target_date).abs().idxmin()
-    actual_date = df.loc[nearest_idx, '日付']
-    price = df.loc[nearest_idx, '終値']
+    # 調整後終値(auto_adjust)は分割・配当のたびに過去の日も遡って書き換わるため、照会日の0時より前に書き込まれた
+    # ファイルは期限切れとする（同じ照会で連結する年のブロックがすべて同じ日に取得したものとなり、調整の基準が揃う）
+    # 当年はさらに取引日が追加されていくため、1時間で1年分をまとめて取り直す
+    ttl = cache.same_day_ttl(asof, cache.CURRENT_YEAR_TTL if year >= asof.year else None)
+    return cache.load_or_fetch(_cache_key(symbol, year), lambda: _download_range(symbol, f"{year}-01-01", f"{year+1}-01-01"), ttl)
+
+def _normalize_symbol(symbol):
+    """銘柄コードを正規化する（Yahoo Finance のティッカーは大文字・小文字を区別しない）"""
+    return symbol.strip().upper()
+
+def refresh_stock_data(symbol):
+    """指定銘柄のディスクキャッシュを削除し、メモリ上のキャッシュもクリアする（再取得用）"""
+    cache.invalidate(f"jp_{_normalize_symbol(symbol)}_")
+    _fetch_year_data.clear()
+
+def get_stock_data(symbol, start_date, end_date):
+    """
+    日次データを取得（yfinance版）
+    引数: symbol(銘柄コード), start_date(開始日), end_date(終了日、この日を含まない) ※"YYYY-MM-DD"形式
+    戻り値: 日付と終値を含むDataFrame、取得失敗時は None
+    """
+    # 引数を正規化し、表記揺れ（銘柄コードの大文字・小文字、日付の書式）で別のキャッシュが作られないようにする
+    symbol = _normalize_symbol(symbol)
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
     
-    diff_days = (actual_date - target_date).days
+    # 暦年単位のブロックで取得・キャッシュし、期間の異なる照会でも同じ年のデータを共有する。未来の年は取得しない
+    # (終了日は含まないため、1月1日が終了日の場合は前年までを対象とする)
+    # 照会日は一度だけ取得してキーに含め、連結する年のブロックを同じ日に取得したものに揃える
+    asof = datetime.date.today()
+    last_year = min((end - pd.Timedelta(days=1)).year, asof.year)
+    years = list(range(start.year, last_year + 1))
     
-    note = "当日"
-    if diff_days > 0: note = f"{diff_days}日後"
-    elif diff_days < 0: note = f"{abs(diff_days)}日前"
+    # 複数年にまたがる場合は各年を並列に取得する
+    df = fetch_year_blocks(lambda y: _fetch_year_data(symbol, y, asof), years)
+    if df is None:
+        # 1年分も取得できなかった場合（通信不可・空の応答）は期限切れのファイルで代替する
+        # (全ブロックが同じ日に取得したファイルである場合に限り、基準の異なるブロックは連結しない)
+        frames = cache.load_same_day([_cache_key(symbol, y) for y in years])
+        if frames is None: return None
+        df = pd.concat(frames, ignore_index=True)
     
-    return actual_date, price, note
+    df = df[(df['日付'] >= start) & (df['日付'] < end)].reset_index(drop=True)
+    return df if not df.empty else None
 
 # --- 日付ルールの計算 ---
 
-def get_futures_delivery(year, month):
-    """日本市場のSQ日：第2金曜日 (期货/SQ相当)"""
-    c = calendar.monthcalendar(year, month)
-    fridays = [week[4] for week in c if week[4] != 0]
-    return datetime.datetime(year, month, fridays[1]) if len(fridays) >= 2 else None
-
-def get_option_delivery(year, month):
-    """米国/国際市場のオプション交割日：第3金曜日"""
-    c = calendar.monthcalendar(year, month)
-    fridays = [week[4] for week in c if week[4] != 0]
-    return datetime.datetime(year, month, fridays[2]) if len(fridays) >= 3 else None
-
-def get_month_end(year, month):
-    """月末の最終日"""
-    _, last_day = calendar.monthrange(year, month)
-    return datetime.datetime(year, month, last_day)
-
-def get_mid_month(year, month):
-    """月中の15日"""
-    return datetime.datetime(year, month, 15)
+# 照会・検証の曜日ルール（SQ日：第2金曜日、オプション交割日：第3金曜日）
+_DATE_RULES = (('sq', 'Fri', 2), ('opt', 'Fri', 3))
 
 # ==========================================
 #                メイン画面ロジック
@@ -103,49 +128,51 @@ def render_jp_ui():
                     key="t1_mode_jp"
                 )
                 t1_run = st.button("株価照会", type="primary", use_container_width=True, key="t1_btn_jp")
+                st.button("データ再取得", use_container_width=True, key="t1_refresh_jp", on_click=refresh_stock_data, args=(t1_code,))
 
         with col1_result:
             if t1_run and t1_code:
                 with st.spinner('照会中...'):
-                    # yfinanceの形式に合わせて日付を調整
-                    df = get_stock_data(t1_code, f"{t1_year}-01-01", f"{t1_year}-12-31")
+                    # 終了日は含まないため翌年1月1日を指定し、年度全体（暦年ブロック1つ分）を対象とする
+                    # (取得・キャッシュは暦年単位のため、回測タブと同じ年度のブロックをそのまま共有する)
+                    df = get_stock_data(t1_code, f"{t1_year}-01-01", f"{t1_year+1}-01-01")
                     if df is not None:
-                        target_list = []
                         mode = "A" if "A:" in t1_mode_sel else "B"
+                        # 基準日は照会ごとに一度だけ取得し、対象日と同じ datetime64[D] 型で比較する
+                        # (np.datetime64('today') は UTC の日付となるため、ローカルの日付から変換する)
+                        today = np.datetime64(datetime.date.today())
+                        table = year_date_table(t1_year, _DATE_RULES)
+                        if mode == "A":
+                            kinds = (("月中", table['mid']), ("月末", table['end']))
+                        else:
+                            kinds = (("SQ日(第2金曜)", table['sq']), ("オプション(第3金曜)", table['opt']))
                         
-                        for m in range(1, 13):
-                            today = datetime.datetime.now()
-                            dates_to_check = []
-                            
-                            if mode == "A":
-                                dates_to_check = [
-                                    ("月中", get_mid_month(t1_year, m)), 
-                                    ("月末", get_month_end(t1_year, m))
-                                ]
-                            else:
-                                f_day = get_futures_delivery(t1_year, m)
-                                o_day = get_option_delivery(t1_year, m)
-                                if f_day: dates_to_check.append(("SQ日(第2金曜)", f_day))
-                                if o_day: dates_to_check.append(("オプション(第3金曜)", o_day))
-                            
-                            for type_name, dt in dates_to_check:
-                                if dt <= today:
-                                    act_date, price, note = get_nearest_price_info(dt, df)
-                                    if price is not None:
-                                        target_list.append({
-                                            "月": f"{dt.strftime('%m')}月",
-                                            "タイプ": type_name,
-                                            "目標日付": dt.strftime("%Y-%m-%d"),
-                                            "実際の取引日": act_date.strftime("%Y-%m-%d"),
-                                            "終値": f"{float(price):.2f}",
-                                            "説明": note
-                                        })
+                        # 月ごとに2種類の対象日を交互に並べ、基準日以前のもののみを対象とする
+                        all_dates = np.column_stack([dates for _, dates in kinds]).ravel()
+                        all_types = np.tile([name for name, _ in kinds], 12)
+                        in_past = all_dates <= today
+                        type_names, target_dates = all_types[in_past], all_dates[in_past]
                         
-                        if target_list:
-                            res_df = pd.DataFrame(target_list)
-                            st.dataframe(res_df, use_container_width=True)
-                            csv = res_df.to_csv(index=False).encode('utf-8-sig')
-                            st.download_button("📥 CSVエクスポート", csv, f"{t1_code}_{t1_year}_基礎照会.csv", "text/csv")
+                        if len(target_dates):
+                            # 全ターゲット日の最寄り取引日を一度の二分探索で求め、結果表を列単位で一括生成する
+                            dates_arr, close_arr = df['日付'].to_numpy(), df['終値'].to_numpy()
+                            targets = pd.DatetimeIndex(target_dates)
+                            nearest_idx = get_nearest_indices(dates_arr, targets.to_numpy())
+                            act_dates = pd.DatetimeIndex(dates_arr[nearest_idx])
+                            diffs = (act_dates - targets).days.to_numpy()
+                            days = np.abs(diffs).astype(str)
+                            notes = np.where(diffs > 0, np.char.add(days, "日後"), np.char.add(days, "日前"))
+                            res_df = pd.DataFrame({
+                                "月": MONTH_LABELS_2D[targets.month - 1], "タイプ": type_names,
+                                "目標日付": targets.strftime("%Y-%m-%d"), "実際の取引日": act_dates.strftime("%Y-%m-%d"),
+                                "終値": close_arr[nearest_idx], "説明": np.where(diffs == 0, "当日", notes)
+                            })
+                            # 終値は数値のまま渡し、小数2桁の表示はフロントエンド側、エクスポートは CSV 書き出し時に行う
+                            st.dataframe(res_df, use_container_width=True, column_config={
+                                "終値": st.column_config.NumberColumn(format="%.2f")
+                            })
+                            # CSV はボタン押下時にのみ生成し、押されない再実行では変換を行わない
+                            st.download_button("📥 CSVエクスポート", lambda: df_to_csv_bytes(res_df, float_format='%.2f'), f"{t1_code}_{t1_year}_基礎照会.csv", "text/csv")
                         else:
                             st.info("該当する日付の履歴データがありません。")
                     else:
@@ -172,6 +199,7 @@ def render_jp_ui():
                     ["翌月第1取引日", "翌月15日(または直近取引日)"], key="sell_rule_jp")
                 
                 t2_run = st.button("検証開始", type="primary", use_container_width=True, key="t2_btn_jp")
+                st.button("データ再取得", use_container_width=True, key="t2_refresh_jp", on_click=refresh_stock_data, args=(t2_code,))
 
         with col2_result:
             if t2_run and t2_code:
@@ -179,61 +207,19 @@ def render_jp_ui():
                     df = get_stock_data(t2_code, f"{t2_year}-01-01", f"{t2_year+1}-03-01")
                     
                     if df is not None:
-                        trades = []
-                        df['Year'] = df['日付'].dt.year
-                        df['Month'] = df['日付'].dt.month
+                        # 売買のターゲット日（月末最終取引日・翌月第1取引日は位置で決まるため None）
+                        buy_targets = None if "最終取引日" in buy_rule else year_date_table(t2_year, _DATE_RULES)['sq' if "SQ日" in buy_rule else 'opt']
+                        sell_targets = None if "第1取引日" in sell_rule else next_month_mids(t2_year)
+                        # 列を一度だけ numpy 配列として取り出し、売買日の確定は共通の処理で12か月分を一括で行う
+                        valid, b_dates, b_prices, s_dates, s_prices = match_monthly_trades(
+                            df['日付'].to_numpy(), df['終値'].to_numpy(), t2_year, buy_targets, sell_targets)
+                        profits = s_prices - b_prices
                         
-                        for m in range(1, 13):
-                            b_date, b_price = None, None
-                            s_date, s_price = None, None
-                            
-                            curr_month_df = df[(df['Year'] == t2_year) & (df['Month'] == m)]
-                            
-                            if not curr_month_df.empty:
-                                if "最終取引日" in buy_rule:
-                                    row = curr_month_df.iloc[-1]
-                                    b_date, b_price = row['日付'], row['終値']
-                                else:
-                                    target_buy = None
-                                    if "SQ日" in buy_rule: target_buy = get_futures_delivery(t2_year, m)
-                                    elif "オプション" in buy_rule: target_buy = get_option_delivery(t2_year, m)
-                                    
-                                    if target_buy:
-                                        nearest_idx = (curr_month_df['日付'] - target_buy).abs().idxmin()
-                                        b_date = curr_month_df.loc[nearest_idx, '日付']
-                                        b_price = curr_month_df.loc[nearest_idx, '終値']
-                            
-                            if b_date: 
-                                next_y = t2_year if m < 12 else t2_year + 1
-                                next_m = m + 1 if m < 12 else 1
-                                next_month_df = df[(df['Year'] == next_y) & (df['Month'] == next_m)]
-                                
-                                if not next_month_df.empty:
-                                    if "第1取引日" in sell_rule:
-                                        row = next_month_df.iloc[0]
-                                        s_date, s_price = row['日付'], row['終値']
-                                    else:
-                                        target_sell = datetime.datetime(next_y, next_m, 15)
-                                        nearest_idx = (next_month_df['日付'] - target_sell).abs().idxmin()
-                                        s_date = next_month_df.loc[nearest_idx, '日付']
-                                        s_price = next_month_df.loc[nearest_idx, '終値']
-                                
-                                if s_date and s_price:
-                                    if s_date > b_date:
-                                        trades.append({
-                                            "月": f"{m}月",
-                                            "買付日": b_date.strftime("%Y-%m-%d"),
-                                            "買付価格": b_price,
-                                            "売却日": s_date.strftime("%Y-%m-%d"),
-                                            "売却価格": s_price,
-                                            "損益": s_price - b_price
-                                        })
-                        
-                        if trades:
-                            t_df = pd.DataFrame(trades)
-                            first_buy = t_df.iloc[0]['買付価格']
-                            last_sell = t_df.iloc[-1]['売却価格']
-                            total_profit = t_df['損益'].sum()
+                        if len(profits):
+                            # 集計は配列のまま行い、DataFrame は表示・エクスポート用にのみ生成する
+                            first_buy = float(b_prices[0])
+                            last_sell = float(s_prices[-1])
+                            total_profit = float(profits.sum())
                             
                             yield_strategy = (total_profit / first_buy) * 100
                             yield_hold_real = (last_sell / first_buy - 1) * 100
@@ -246,13 +232,19 @@ def render_jp_ui():
                             k3.metric("長期保有収益率 (死守)", f"{yield_hold_real:.2f}%", delta=f"{hold_profit:.2f}")
                             
                             st.markdown("---")
-                            display_df = t_df.copy()
-                            cols = ['買付価格', '売却価格', '損益']
-                            for c in cols: display_df[c] = display_df[c].apply(lambda x: f"{float(x):.2f}")
-                            
-                            st.dataframe(display_df, use_container_width=True, hide_index=True)
-                            csv = display_df.to_csv(index=False).encode('utf-8-sig')
-                            st.download_button("📥 結果エクスポート", csv, f"{t2_code}_戦略検証.csv", "text/csv")
+                            t_df = pd.DataFrame({
+                                "月": MONTH_LABELS[valid],
+                                "買付日": b_dates, "買付価格": b_prices,
+                                "売却日": s_dates, "売却価格": s_prices, "損益": profits
+                            })
+                            # 価格列・日付列は値の型のまま渡し、表示形式はフロントエンド側で指定する（値の順での並べ替えも維持される）
+                            st.dataframe(t_df, use_container_width=True, hide_index=True, column_config={
+                                **{c: st.column_config.NumberColumn(format="%.2f") for c in ('買付価格', '売却価格', '損益')},
+                                **{c: st.column_config.DateColumn(format="YYYY-MM-DD") for c in ('買付日', '売却日')}
+                            })
+                            # エクスポートするCSVでは小数2桁で出力する（時刻を含まない日付列は YYYY-MM-DD で出力される）
+                            # CSV はボタン押下時にのみ生成する
+                            st.download_button("📥 結果エクスポート", lambda: df_to_csv_bytes(t_df, float_format='%.2f'), f"{t2_code}_戦略検証.csv", "text/csv")
                         else:
                             st.warning(f"該当年度 ({t2_year}) のデータが不足しているか、取引が成立しませんでした。")
 
@@ -271,7 +263,8 @@ def render_jp_ui():
         with col3_right:
             if os.path.exists(target_file):
                 try:
-                    df_rank = pd.read_csv(target_file)
+                    # pyarrow のCSVパーサーで読み込み、列も Arrow 型のまま保持する（object 型への変換を省く）
+                    df_rank = load_ranking(target_file, engine='pyarrow', dtype_backend='pyarrow')
                     st.success(f"✅ ファイルの読み込みに成功しました。計 {len(df_rank)} 件。")
                     st.subheader("🏆 スイング推奨ランキング（未完成）")
                     st.dataframe(df_rank.head(10), use_container_width=True)
@@ -0,0 +1,35 @@
+# net.py
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# =============================================================================
+# HTTP接続の共有 (Pooled HTTP Session)
+# akshare は内部で requests.get を呼び出すたびに接続を作り直すため、
+# 共有セッション経由に差し替えて TCP/TLS 接続を再利用する（並列スキャン時の効果が大きい）
+# =============================================================================
+
+POOL_SIZE = 32 # 並列取得のワーカー数を上回る接続数を確保する
+
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=3)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+
+_lock = threading.Lock()
+_installed = False
+
+def _pooled_get(url, params=None, **kwargs):
+    """requests.get と同じ引数で、共有セッションから GET を送信する"""
+    return _session.get(url, params=params, **kwargs)
+
+def install():
+    """
+    requests.get を共有セッション版に差し替える（akshare の呼び出し前に実行する）
+    複数スレッドから何度呼ばれても差し替えは一度だけ行う
+    """
+    global _installed
+    with _lock:
+        if not _installed:
+            requests.get = _pooled_get
+            _installed = True
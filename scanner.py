@@ -0,0 +1,95 @@
+# scanner.py
+import glob
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from engine_cn import get_stock_data, run_backtest, BUY_RULES, SELL_RULES
+import net
+
+# =============================================================================
+# ランキング用スキャン (Universe Scanner)
+# 指数の構成銘柄をまとめて回測し、排行榜タブで読み込むスキャンファイルを生成する
+# =============================================================================
+
+# データセット名 → 中証指数の指数コード
+INDEX_CODES = {"SSE50": "000016", "CSI300": "000300"}
+
+def get_index_members(dataset):
+    """
+    指数の構成銘柄を取得する
+    戻り値: '代码', '名称' 列を持つDataFrame
+    """
+    import akshare as ak
+    net.install()
+    df = ak.index_stock_cons_csindex(symbol=INDEX_CODES[dataset])
+    return df.rename(columns={'成分券代码': '代码', '成分券名称': '名称'})[['代码', '名称']]
+
+# データを取得できなかった銘柄の割合の上限。これを超えた場合は通信障害（アクセス制限等）とみなし、スキャン結果を保存しない
+MAX_FAILURE_RATIO = 0.1
+
+def _scan_one(symbol, year):
+    """
+    1銘柄をデフォルトの売買ルールで回測し、(波段収益率, 死拿収益率) を返す（取引が成立しなければ None）
+    データを取得できなかった場合は LookupError を送出する
+    """
+    df = get_stock_data(symbol, f"{year}0101", f"{year+1}0301")
+    if df is None:
+        raise LookupError(f"no trading data for {symbol} ({year})")
+    t_df = run_backtest(df, year, BUY_RULES[0], SELL_RULES[0])
+    if t_df.empty: return None
+    first_buy, last_sell = t_df.iloc[0]['买入价'], t_df.iloc[-1]['卖出价']
+    return t_df['收益'].sum() / first_buy * 100, (last_sell / first_buy - 1) * 100
+
+def scan_universe(symbols, year, workers=16):
+    """
+    複数銘柄の回測を並列に実行する（akshare にはバッチ取得APIがないため、スレッドで通信待ちを重ねる）
+    戻り値: ({銘柄コード: (波段収益率, 死拿収益率) または None(取引不成立)}, データを取得できなかった銘柄コードのリスト)
+    """
+    def scan(sym):
+        # データ取得の失敗のみを銘柄単位の失敗として扱い、それ以外の例外（プログラムの誤り）はそのまま送出する
+        try:
+            return _scan_one(sym, year)
+        except LookupError as e:
+            return e
+
+    # ワーカースレッドにも実行コンテキストを引き継ぎ、データのキャッシュをそのまま利用できるようにする
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=workers, initializer=add_script_run_ctx, initargs=(None, ctx)) as ex:
+        outcomes = dict(zip(symbols, ex.map(scan, symbols)))
+    failed = [sym for sym, res in outcomes.items() if isinstance(res, LookupError)]
+    return {sym: res for sym, res in outcomes.items() if not isinstance(res, LookupError)}, failed
+
+def build_ranking(dataset, year, workers=16):
+    """
+    指数の構成銘柄をスキャンし、相対超額の降順に並べたランキングを返す
+    戻り値: (ランキングのDataFrame, データを取得できなかった銘柄コードのリスト)
+            DataFrame は '代码', '名称', '波段收益(%)', '死拿收益(%)', '相对超额(%)' 列を持つ
+    失敗した銘柄が多すぎる場合・1銘柄も集計できなかった場合は RuntimeError を送出する（既存のファイルを上書きさせない）
+    """
+    members = get_index_members(dataset)
+    results, failed = scan_universe(members['代码'].tolist(), year, workers)
+    if len(failed) > len(members) * MAX_FAILURE_RATIO:
+        raise RuntimeError(f"{len(failed)}/{len(members)} symbols failed to load")
+    rows = [(code, name, *results[code]) for code, name in zip(members['代码'], members['名称']) if results.get(code)]
+    if not rows:
+        raise RuntimeError(f"no symbol of {dataset} produced a trade in {year}")
+    df = pd.DataFrame(rows, columns=['代码', '名称', '波段收益(%)', '死拿收益(%)'])
+    df['相对超额(%)'] = df['波段收益(%)'] - df['死拿收益(%)']
+    return df.round(2).sort_values('相对超额(%)', ascending=False, ignore_index=True), failed
+
+def save_ranking(df, path):
+    """ランキングを Parquet (zstd 圧縮) で保存する。列の型が保持され、読み込み時の解析も不要になる"""
+    df.to_parquet(path, index=False, compression='zstd')
+
+def migrate_csv_files(pattern="*_Scan_*.csv"):
+    """既存の CSV スキャンファイルを同名の Parquet ファイルに変換する（一度だけ実行すればよい）"""
+    for path in glob.glob(pattern):
+        # 銘柄コードの先頭の0が落ちないよう文字列として読む
+        df = pd.read_csv(path, dtype={'代码': str})
+        out = path[:-len(".csv")] + ".parquet"
+        save_ranking(df, out)
+        print(f"{path} -> {out}")
+
+if __name__ == "__main__":
+    # 使い方: python scanner.py  （カレントディレクトリの CSV スキャンファイルを変換する）
+    migrate_csv_files()
@@ -0,0 +1,151 @@
+# utils.py
+import io
+import os
+from functools import lru_cache
+import streamlit as st
+import pandas as pd
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+# =============================================================================
+# 共通ツール関数ライブラリ (Shared Utility Functions)
+# 市場別エンジン (engine_cn.py / engine_jp.py) から共通で利用し、キャッシュも共有する
+# =============================================================================
+
+# 結果表の月ラベル（行ごとに書式化せず、月番号-1 の位置で参照する）
+MONTH_LABELS = np.array([f"{m}月" for m in range(1, 13)])
+MONTH_LABELS_2D = np.array([f"{m:02d}月" for m in range(1, 13)])
+
+def get_nearest_indices(dates, targets, lo=None, hi=None):
+    """
+    昇順に並んだ取引日配列から、各ターゲット日に最も近い取引日の位置を一括で検索する
+    引数: dates(取引日の datetime64 配列), targets(ターゲット日の datetime64 配列),
+          lo/hi(各ターゲットの検索範囲 [lo, hi) の位置。省略時は配列全体。空範囲の結果は不定)
+    戻り値: targets と同じ長さの位置インデックス配列
+    """
+    lo = 0 if lo is None else lo
+    hi = len(dates) if hi is None else hi
+    # 単位の細かい方に揃えてから int64 として扱い、探索・差分の計算で単位変換が繰り返されないようにする
+    # (取引日側の単位が細かければ、取引日の配列はコピーせずにそのまま参照する)
+    unit = np.result_type(dates.dtype, targets.dtype)
+    dates = dates.astype(unit, copy=False).view('i8')
+    targets = targets.astype(unit, copy=False).view('i8')
+    # 二分探索で挿入位置を求め、検索範囲内で前後の取引日のうち近い方を選択する
+    pos = np.searchsorted(dates, targets)
+    right = np.clip(pos, lo, hi - 1)
+    left = np.clip(pos - 1, lo, hi - 1)
+    # 差が同じ場合は前の取引日を優先する（idxmin と同じ挙動）
+    return np.where(targets - dates[left] <= dates[right] - targets, left, right)
+
+def get_month_edges(dates, year, n_months):
+    """
+    昇順に並んだ取引日配列を月ごとに区切る位置を求める（日付の年・月の列を作らず、月単位の二分探索で求める）
+    引数: dates(取引日の datetime64 配列), year(起点の年。1月から数える), n_months(月数)
+    戻り値: 長さ n_months+1 の位置配列。k番目の月の行範囲は [edges[k], edges[k+1])
+    """
+    months = np.arange(np.datetime64(f"{year}-01"), np.datetime64(f"{year}-01") + n_months + 1)
+    return np.searchsorted(dates.astype('datetime64[M]'), months)
+
+def fetch_year_blocks(fetch_year, years):
+    """
+    暦年単位のブロックを並列に取得し、年の順に連結する（HTTP待ちの間はGILが解放される）
+    引数: fetch_year(年を受け取り DataFrame または None を返す関数), years(年のリスト)
+    戻り値: 連結したDataFrame、取得できた年がない・取得中に例外が発生した場合は None
+    """
+    if not years: return None
+    # ワーカースレッドにも実行コンテキストを引き継ぎ、キャッシュをそのまま利用できるようにする
+    ctx = get_script_run_ctx()
+    try:
+        with ThreadPoolExecutor(max_workers=min(4, len(years)), initializer=add_script_run_ctx, initargs=(None, ctx)) as ex:
+            frames = list(ex.map(fetch_year, years))
+    except Exception as e:
+        return None
+    frames = [f for f in frames if f is not None]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def match_monthly_trades(dates, closes, year, buy_targets=None, sell_targets=None):
+    """
+    月次の波段取引の売買日を12か月分まとめて求める（買入は対象月内、売出は翌月内に厳格限定）
+    引数: dates/closes(翌年2月までの取引日・終値の配列), year(回測年),
+          buy_targets(各月の買入ターゲット日。None は月末最終取引日), sell_targets(各月の売出ターゲット日。None は翌月第1取引日)
+    戻り値: (valid, 買入日, 買入価格, 売出日, 売出価格)。valid は取引が成立した月を示す長さ12の真偽配列、
+            残りは成立した月のみの配列
+    """
+    # 対象年1月〜翌年2月の各月の行範囲 [lo, hi) を月単位の二分探索で一括で求める（日付は昇順のため各月は連続）
+    # 該当月のデータがなければ lo == hi の空範囲となる
+    edges = get_month_edges(dates, year, 14)
+    buy_lo, buy_hi = edges[:12], edges[1:13]
+    sell_lo, sell_hi = edges[1:13], edges[2:14]
+
+    # 1. 買入日の確定 (対象月内に限定、12か月分を一括で検索)
+    buy_idx = buy_hi - 1 if buy_targets is None else get_nearest_indices(dates, buy_targets, buy_lo, buy_hi)
+    # 2. 売出日の確定 (翌月内に限定、12か月分を一括で検索)
+    sell_idx = sell_lo if sell_targets is None else get_nearest_indices(dates, sell_targets, sell_lo, sell_hi)
+
+    # 3. 取引の成立判定 (買入月・売出月の両方にデータがあり、売出価格が有効で売出日が買入日より後の月のみ)
+    # (データのない月の位置は範囲外の値を指すことがあるため、必ず valid で除外する)
+    buy_idx, sell_idx = np.clip(buy_idx, 0, len(dates) - 1), np.clip(sell_idx, 0, len(dates) - 1)
+    b_dates, s_dates = dates[buy_idx], dates[sell_idx]
+    b_prices, s_prices = closes[buy_idx], closes[sell_idx]
+    valid = (buy_hi > buy_lo) & (sell_hi > sell_lo) & (s_prices != 0) & (s_dates > b_dates)
+    return valid, b_dates[valid], b_prices[valid], s_dates[valid], s_prices[valid]
+
+@lru_cache(maxsize=128)
+def year_date_table(year, rules=()):
+    """
+    1年分(12か月)の対象日をまとめて求める（年とルールの組ごとにメモ化し、照会・回測で共有する）
+    引数: year(年), rules(市場ごとの曜日ルール。(名前, 曜日 'Mon'〜'Sun', 第n) のタプル)
+    戻り値: 'mid'(月中の15日), 'end'(月末の最終日) と rules の各名前(第n該当曜日)をキーとする
+            datetime64[D] 配列(長さ12)の dict
+    """
+    # 月単位の datetime64 配列を起点に、numpy のベクトル演算で各月の対象日を求める
+    months = np.arange(np.datetime64(f"{year}-01"), np.datetime64(f"{year + 1}-01"))
+    firsts = months.astype('datetime64[D]')
+    table = {
+        'mid': firsts + np.timedelta64(14, 'D'),
+        'end': (months + 1).astype('datetime64[D]') - np.timedelta64(1, 'D'),
+    }
+    # 月初以降の最初の該当曜日から数えて、第n該当曜日を求める
+    for name, weekday, nth in rules:
+        table[name] = np.busday_offset(firsts, nth - 1, roll='forward', weekmask=weekday)
+    # キャッシュした配列が呼び出し側で書き換えられないよう読み取り専用にする
+    for arr in table.values():
+        arr.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=128)
+def next_month_mids(year):
+    """
+    各月の翌月15日（対象年2月〜12月と翌年1月の月中）を求める（回測の売出ターゲット日）
+    戻り値: 読み取り専用の datetime64[D] 配列(長さ12)
+    """
+    mids = np.concatenate([year_date_table(year)['mid'][1:], year_date_table(year + 1)['mid'][:1]])
+    mids.flags.writeable = False
+    return mids
+
+@st.cache_data(ttl=3600, max_entries=16, show_spinner=False)
+def _read_ranking(path, mtime, csv_options):
+    """スキャンファイルを読み込む（更新時刻をキーに含め、再スキャン・ファイル更新後は読み直す）"""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, **csv_options)
+
+def load_ranking(path, **csv_options):
+    """
+    スキャンファイル(Parquet / CSV)を読み込む（タブ切り替え等の再実行時はキャッシュから返す）
+    csv_options: CSV の場合に pd.read_csv へ渡す、市場ごとの読み込みオプション
+    """
+    return _read_ranking(path, os.path.getmtime(path), csv_options)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def df_to_csv_bytes(df, float_format=None):
+    """
+    ダウンロード用にDataFrameをCSV(UTF-8 BOM付き)へ変換する
+    float_format: 浮動小数点列の書式（例 '%.2f'）。省略時は pandas の既定の書式
+    内容が同じDataFrameであれば再実行時もキャッシュから返す
+    """
+    # 文字列を経由せず、BOM付きUTF-8のバイト列としてバッファへ直接書き出す
+    buf = io.BytesIO()
+    df.to_csv(buf, index=False, float_format=float_format, encoding='utf-8-sig', lineterminator='\n')
+    return buf.getvalue()